@@ -19,6 +19,15 @@ import os
 import math
 import time
 
+# .inks tokens (compiled once at import, shared by every load)
+# layer header attributes, e.g. id=1 name="paint" visible=true
+_ATTR_RE = re.compile(r'(\w+)=(\"[^\"]+\"|\S+)')
+_DRAW_PATH_RE = re.compile(r'draw\s+path\s+([^{}]+)\{')
+_ID_RE = re.compile(r'id=([^\s{]+)')
+_REF_RE = re.compile(r'ref=([^\s]+)')
+# statements that can never be a style line following a draw block
+_STATEMENT_RE = re.compile(r'^(draw|set|layer|transform|erase|canvas|background)\b')
+
 # ----------------------------
 # Models
 # ----------------------------
@@ -615,7 +624,7 @@ class InkPaint:
                     self.bg_color = parts[1].strip()
             elif line.startswith("layer"):
                 # finish previous layer
-                attrs = dict(re.findall(r'(\w+)=(\"[^\"]+\"|\S+)', line))
+                attrs = dict(_ATTR_RE.findall(line))
                 lid = int(attrs.get("id", self.layer_counter))
                 name = attrs.get("name", f"Layer {lid}").strip('"')
                 vis = attrs.get("visible", "true") == "true"
@@ -628,10 +637,10 @@ class InkPaint:
                 current_layer = None
             elif line.startswith("draw") and "path" in line and current_layer:
                 # parse header like: draw path id=stroke_1 {
-                m = re.match(r'draw\s+path\s+([^{}]+)\{', line)
+                m = _DRAW_PATH_RE.match(line)
                 if m:
                     attrs = m.group(1).strip()
-                    attrs_d = dict(re.findall(r'(\w+)=(\"[^\"]+\"|\S+)', attrs))
+                    attrs_d = dict(_ATTR_RE.findall(attrs))
                     sid = attrs_d.get("id", f"stroke_{self.stroke_counter}")
                 else:
                     sid = f"stroke_{self.stroke_counter}"
@@ -663,7 +672,7 @@ class InkPaint:
                 if len(parts) == 2:
                     self.bg_color = parts[1].strip()
             elif line.startswith("layer"):
-                attrs = dict(re.findall(r'(\w+)=(\"[^\"]+\"|\S+)', line))
+                attrs = dict(_ATTR_RE.findall(line))
                 lid = int(attrs.get("id", self.layer_counter))
                 name = attrs.get("name", f"Layer {lid}").strip('"')
                 vis = attrs.get("visible", "true") == "true"
@@ -675,7 +684,7 @@ class InkPaint:
                 current_layer = None
             elif line.startswith("draw") and "path" in line and current_layer:
                 # parse id if present
-                m = re.search(r'id=([^\s{]+)', line)
+                m = _ID_RE.search(line)
                 sid = m.group(1) if m else f"stroke_{self.stroke_counter}"
                 if sid.startswith('"') and sid.endswith('"'):
                     sid = sid.strip('"')
@@ -709,7 +718,7 @@ class InkPaint:
                         look_idx += 1
                         continue
                     # if line has '=' tokens and doesn't begin a keyword, treat as style
-                    if "=" in nxt and not re.match(r'^(draw|set|layer|transform|erase|canvas|background)\b', nxt):
+                    if "=" in nxt and not _STATEMENT_RE.match(nxt):
                         for token in nxt.split():
                             if "=" in token:
                                 k, v = token.split("=", 1)
@@ -730,7 +739,7 @@ class InkPaint:
                         pass
             elif line.startswith("erase") and current_layer:
                 # e.g. erase ref=stroke_3
-                m = re.search(r'ref=([^\s]+)', line)
+                m = _REF_RE.search(line)
                 if m:
                     rid = m.group(1)
                     # find stroke in current layer and mark erased
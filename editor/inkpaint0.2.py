@@ -30,6 +30,14 @@ import json
 AUTOSAVE_FILENAME = os.path.join(tempfile.gettempdir(), "inkscript_autosave.inks")
 AUTOSAVE_INTERVAL_MS = 60_000  # 60 seconds
 
+# .inks tokens (compiled once at import, shared by every load)
+# layer header attributes, e.g. id=1 name="paint" visible=true
+_ATTR_RE = re.compile(r'(\w+)=(\"[^\"]+\"|\S+)')
+_ID_RE = re.compile(r'id=([^\s{]+)')
+_REF_RE = re.compile(r'ref=([^\s]+)')
+# statements that can never be a style line following a draw block
+_STATEMENT_RE = re.compile(r'^(draw|set|layer|transform|erase|canvas|background)\b')
+
 # ----------------------------
 # Models
 # ----------------------------
@@ -925,7 +933,7 @@ class InkPaint:
                 if len(parts) == 2:
                     self.bg_color = parts[1].strip()
             elif line.startswith("layer"):
-                attrs = dict(re.findall(r'(\w+)=(\"[^\"]+\"|\S+)', line))
+                attrs = dict(_ATTR_RE.findall(line))
                 lid = int(attrs.get("id", self.layer_counter))
                 name = attrs.get("name", f"Layer {lid}").strip('"')
                 vis = attrs.get("visible", "true") == "true"
@@ -937,7 +945,7 @@ class InkPaint:
                 current_layer = None
             elif line.startswith("draw") and "path" in line and current_layer:
                 # parse id if present
-                m = re.search(r'id=([^\s{]+)', line)
+                m = _ID_RE.search(line)
                 sid = m.group(1) if m else f"stroke_{self.stroke_counter}"
                 if sid.startswith('"') and sid.endswith('"'):
                     sid = sid.strip('"')
@@ -965,7 +973,7 @@ class InkPaint:
                     if not nxt or nxt.startswith("#"):
                         look_idx += 1
                         continue
-                    if "=" in nxt and not re.match(r'^(draw|set|layer|transform|erase|canvas|background)\b', nxt):
+                    if "=" in nxt and not _STATEMENT_RE.match(nxt):
                         for token in nxt.split():
                             if "=" in token:
                                 k, v = token.split("=", 1)
@@ -986,7 +994,7 @@ class InkPaint:
                     except:
                         pass
             elif line.startswith("erase") and current_layer:
-                m = re.search(r'ref=([^\s]+)', line)
+                m = _REF_RE.search(line)
                 if m:
                     rid = m.group(1)
                     for s in current_layer.strokes:
@@ -16,6 +16,10 @@ Other features unchanged from 0.2.
 import tkinter as tk
 from tkinter import filedialog, colorchooser, messagebox
 from PIL import Image, ImageDraw
+import array
+import collections
+import functools
+import itertools
 import re
 import os
 import math
@@ -23,9 +27,37 @@ import time
 import copy
 import tempfile
 import json
+import threading
 
 AUTOSAVE_FILENAME = os.path.join(tempfile.gettempdir(), "inkscript_autosave.inks")
 AUTOSAVE_INTERVAL_MS = 60_000  # 60 seconds
+UNDO_LIMIT = 500  # oldest history entries are dropped past this
+MOVE_COALESCE_S = 0.3  # drags of the same selection this close together undo as one move
+
+# .inks tokens (compiled once at import, shared by every load)
+# layer header attributes, e.g. id=1 name="paint" visible=true
+_ATTR_RE = re.compile(r'(\w+)=("[^"]+"|\S+)')
+# path ids, erase refs and style tokens, e.g. "} stroke=#fff strokeWidth=3"
+_TOKEN_RE = re.compile(r'\b(id|ref|stroke|strokeWidth|color|fill|width)=("[^"]*"|\S+)')
+# statements the loader dispatches on, anchored at the start of a (non-comment) line
+_STMT_RE = re.compile(r'^[^\S\n]*(canvas|background|layer|\}|draw|erase)[^\n]*', re.M)
+# "move x y" / "line x y" commands inside a draw block body
+_POINT_RE = re.compile(r'^[^\S\n]*(?:move|line)[^\S\n]+(\S+)[^\S\n]+(\S+)', re.M)
+
+@functools.lru_cache(maxsize=256)
+def _hex_to_rgb(h):
+    # "#rrggbb" / "#rgb" -> (r, g, b); documents use a handful of colors, so results are cached
+    if not h:
+        return (0,0,0)
+    h = h.lstrip("#")
+    try:
+        if len(h) == 6:
+            return tuple(int(h[i:i+2], 16) for i in (0, 2, 4))
+        if len(h) == 3:
+            return tuple(int(h[i]*2, 16) for i in range(3))
+    except ValueError:
+        pass  # not hex digits; falls back like any other unreadable color
+    return (0,0,0)
 
 # ----------------------------
 # Models
@@ -36,12 +68,72 @@ class Stroke:
         self.id = stroke_id
         self.color = color
         self.width = width
-        self.points = points or []
         self.erased = False  # non-destructive erase
         self.fill = fill  # optional fill color
+        self.set_points(points or ())
+
+    # color and fill keep their RGB tuples alongside, resolved once when assigned
+    # so export never parses hex in its per-stroke loop
+
+    @property
+    def color(self):
+        return self._color
+
+    @color.setter
+    def color(self, value):
+        self._color = value
+        self.rgb = _hex_to_rgb(value or "#000000")
+
+    @property
+    def fill(self):
+        return self._fill
+
+    @fill.setter
+    def fill(self, value):
+        self._fill = value
+        self.fill_rgb = _hex_to_rgb(value) if value else None
+
+    # Points are stored flat (x0, y0, x1, y1, ...) in one float32 array: 8 bytes per point
+    # instead of a tuple and two float objects, and PIL reads the buffer directly.
+
+    def set_points(self, pts):
+        # pts: iterable of (x, y) pairs
+        self.points = array.array("f", [c for p in pts for c in p])
+        self.update_bbox()
+
+    def set_flat_points(self, flat):
+        # flat: array("f") already laid out as x0, y0, x1, y1, ...
+        self.points = flat
+        self.update_bbox()
+
+    def append_point(self, x, y):
+        self.points.append(x)
+        self.points.append(y)
+
+    def point_count(self):
+        return len(self.points) // 2
+
+    def iter_points(self):
+        it = iter(self.points)
+        return zip(it, it)
+
+    def last_point(self):
+        return (self.points[-2], self.points[-1])
+
+    def update_bbox(self):
+        # cached (minx, miny, maxx, maxy) of the points; call after replacing or appending points
+        if not self.points:
+            self.bbox = None
+            return
+        xs = self.points[0::2]
+        ys = self.points[1::2]
+        self.bbox = (min(xs), min(ys), max(xs), max(ys))
 
-    def copy_points(self):
-        return [ (x,y) for (x,y) in self.points ]
+    def translate(self, dx, dy):
+        self.points = array.array("f", [v + d for v, d in zip(self.points, itertools.cycle((dx, dy)))])
+        if self.bbox:
+            x0, y0, x1, y1 = self.bbox
+            self.bbox = (x0 + dx, y0 + dy, x1 + dx, y1 + dy)
 
 class Layer:
     def __init__(self, layer_id, name="Layer", visible=True):
@@ -50,6 +142,80 @@ class Layer:
         self.visible = visible
         self.strokes = []
 
+class StrokeIndex:
+    """
+    Uniform grid over stroke bounding boxes (grown by half the stroke width).
+    query() returns the strokes whose box touches a world rectangle, so hit tests only
+    look at the points of nearby strokes instead of every point in the document.
+    Strokes covering more than max_cells cells, or with a non-finite bbox, are kept in a
+    "large" set that every query returns, so indexing cost can't grow with bbox area.
+    """
+    def __init__(self, cell_size=128, max_cells=1024):
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self._cells = {}     # (col, row) -> set of strokes
+        self._keys = {}      # stroke -> cell keys it is stored under
+        self._large = set()  # strokes too big (or malformed) to grid
+
+    def _cell_range(self, x0, y0, x1, y1):
+        # (col0, col1, row0, row1), or None if the rectangle isn't finite or spans too many cells
+        if not (math.isfinite(x0) and math.isfinite(y0) and math.isfinite(x1) and math.isfinite(y1)):
+            return None
+        c = self.cell_size
+        col0, col1 = int(x0 // c), int(x1 // c)
+        row0, row1 = int(y0 // c), int(y1 // c)
+        if (col1 - col0 + 1) * (row1 - row0 + 1) > self.max_cells:
+            return None
+        return col0, col1, row0, row1
+
+    def insert(self, stroke):
+        # (re)index a stroke under its current bbox
+        self.remove(stroke)
+        if not stroke.bbox:
+            return
+        r = max(1, (stroke.width or 1) / 2)
+        x0, y0, x1, y1 = stroke.bbox
+        # min()/max() can step over a NaN point, so the points themselves are checked too
+        span = self._cell_range(x0 - r, y0 - r, x1 + r, y1 + r)
+        if span is None or not math.isfinite(sum(stroke.points)):
+            self._large.add(stroke)
+            return
+        col0, col1, row0, row1 = span
+        keys = [(col, row) for col in range(col0, col1 + 1) for row in range(row0, row1 + 1)]
+        for key in keys:
+            self._cells.setdefault(key, set()).add(stroke)
+        self._keys[stroke] = keys
+
+    def remove(self, stroke):
+        self._large.discard(stroke)
+        for key in self._keys.pop(stroke, ()):
+            bucket = self._cells.get(key)
+            if bucket is not None:
+                bucket.discard(stroke)
+                if not bucket:
+                    del self._cells[key]
+
+    def clear(self):
+        self._cells.clear()
+        self._keys.clear()
+        self._large.clear()
+
+    def query(self, x0, y0, x1, y1):
+        found = set(self._large)
+        span = self._cell_range(x0, y0, x1, y1)
+        if span is None:
+            # a query wider than the cap just returns everything
+            found.update(self._keys)
+            return found
+        col0, col1, row0, row1 = span
+        cells = self._cells
+        for col in range(col0, col1 + 1):
+            for row in range(row0, row1 + 1):
+                bucket = cells.get((col, row))
+                if bucket:
+                    found |= bucket
+        return found
+
 # ----------------------------
 # Undo/Redo Actions
 # ----------------------------
@@ -65,9 +231,11 @@ class ActionEraseStrokes:
         self.stroke_ids = stroke_ids
 
 class ActionMoveStrokes:
-    def __init__(self, layer_id, stroke_snapshots):  # list of (stroke_id, old_pts, new_pts)
+    def __init__(self, layer_id, stroke_ids, dx, dy):  # a move is a uniform translation
         self.layer_id = layer_id
-        self.stroke_snapshots = stroke_snapshots
+        self.stroke_ids = stroke_ids
+        self.dx = dx
+        self.dy = dy
 
 # ----------------------------
 # InkPaint App
@@ -99,8 +267,11 @@ class InkPaint:
         self.eraser_width = 20
 
         # history
-        self.undo_stack = []
-        self.redo_stack = []
+        # bounded: appending past UNDO_LIMIT evicts the oldest entry
+        self.undo_stack = collections.deque(maxlen=UNDO_LIMIT)
+        self.redo_stack = collections.deque(maxlen=UNDO_LIMIT)
+        self._last_move = None  # most recent ActionMoveStrokes pushed, for coalescing
+        self._last_move_time = 0.0
 
         # viewport transform (world <-> screen)
         self.scale = 1.0
@@ -109,9 +280,16 @@ class InkPaint:
         self.min_scale = 0.2
         self.max_scale = 4.0
 
+        # lookups over every stroke held by a layer, kept by _register_stroke/_unregister_stroke:
+        # a spatial index for hit tests and a (layer, id) -> stroke map for undo and load
+        # (ids only have to be unique within their layer)
+        self._stroke_index = StrokeIndex()
+        self._stroke_by_id = {}
+
         # selection state
         self.selected_strokes = []  # list of Stroke refs
         self._moving_selection = False
+        self._move_shared_ids = set()  # selected ids another stroke also uses; see on_pointer_down
 
         # active drawing state
         self._active_stroke = None
@@ -121,6 +299,15 @@ class InkPaint:
         self._sel_start = None
         self._sel_rect = None
 
+        # repaint scheduling (see _invalidate)
+        self._redraw_scheduled = False
+
+        # set by every edit, cleared once the document is on disk; autosave skips clean documents
+        self._dirty = False
+
+        # autosave files are written off the Tk thread; the lock keeps writes from overlapping
+        self._autosave_lock = threading.Lock()
+
         # autosave recovery check before UI built
         self._autosave_present = os.path.exists(AUTOSAVE_FILENAME)
 
@@ -257,6 +444,8 @@ class InkPaint:
         self.canvas.bind("<Button-4>", self._on_mouse_wheel)    # Linux scroll up
         self.canvas.bind("<Button-5>", self._on_mouse_wheel)    # Linux scroll down
         self.canvas.bind("<Motion>", self.on_pointer_motion)
+        # redraw is culled to the viewport, so a resize must repaint what it uncovers
+        self.canvas.bind("<Configure>", lambda e: self._invalidate())
 
         # Keep map of canvas IDs for quick deletion (screen items)
         self._canvas_item_map = {}  # stroke_id -> [canvas_item_ids]
@@ -267,6 +456,7 @@ class InkPaint:
 
     def new_document(self):
         self.layers.clear()
+        self._clear_stroke_lookups()
         self.layer_counter = 1
         self.stroke_counter = 1
         self.undo_stack.clear()
@@ -276,8 +466,9 @@ class InkPaint:
         self.offset_y = 0.0
         self.add_layer(name="Layer 1")
         self.current_layer_index = 0
+        self._dirty = False
         self._refresh_layer_list()
-        self._redraw_canvas()
+        self._invalidate()
         self.status_set("New document")
 
     def add_layer(self, name=None):
@@ -286,8 +477,9 @@ class InkPaint:
         self.layer_counter += 1
         self.layers.insert(0, layer)  # new layer at top
         self.current_layer_index = 0
+        self._dirty = True
         self._refresh_layer_list()
-        self._redraw_canvas()
+        self._invalidate()
         self.status_set(f"Added layer '{name}'")
 
     def remove_layer(self):
@@ -297,9 +489,12 @@ class InkPaint:
         if idx < 0 or idx >= len(self.layers):
             return
         layer = self.layers.pop(idx)
+        for s in layer.strokes:
+            self._unregister_stroke(layer, s)
         self.current_layer_index = max(0, min(idx, len(self.layers)-1))
+        self._dirty = True
         self._refresh_layer_list()
-        self._redraw_canvas()
+        self._invalidate()
         self.status_set(f"Removed layer '{layer.name}'")
 
     def move_layer_up(self):
@@ -307,35 +502,39 @@ class InkPaint:
         if idx > 0:
             self.layers[idx-1], self.layers[idx] = self.layers[idx], self.layers[idx-1]
             self.current_layer_index -= 1
+            self._dirty = True
             self._refresh_layer_list()
-            self._redraw_canvas()
+            self._invalidate()
 
     def move_layer_down(self):
         idx = self.current_layer_index
         if idx < len(self.layers)-1:
             self.layers[idx+1], self.layers[idx] = self.layers[idx], self.layers[idx+1]
             self.current_layer_index += 1
+            self._dirty = True
             self._refresh_layer_list()
-            self._redraw_canvas()
+            self._invalidate()
 
     def toggle_layer_visibility(self):
         layer = self._current_layer()
         if not layer:
             return
         layer.visible = not layer.visible
+        self._dirty = True
         self._refresh_layer_list()
-        self._redraw_canvas()
+        self._invalidate()
 
     def clear_current_layer(self):
         layer = self._current_layer()
         if not layer:
             return
         removed_ids = [s.id for s in layer.strokes if not s.erased]
+        for s in layer.strokes:
+            self._unregister_stroke(layer, s)
         layer.strokes.clear()
         self._canvas_delete_strokes(removed_ids)
-        self.undo_stack.append(ActionEraseStrokes(layer.id, removed_ids))
-        self.redo_stack.clear()
-        self._redraw_canvas()
+        self._push_undo(ActionEraseStrokes(layer.id, removed_ids))
+        self._invalidate()
         self.status_set("Cleared current layer")
 
     def on_layer_select(self, event=None):
@@ -344,7 +543,7 @@ class InkPaint:
             self.current_layer_index = sel[0]
         else:
             self.current_layer_index = 0
-        self._redraw_canvas()
+        self._invalidate()
 
     def _refresh_layer_list(self):
         self.layers_listbox.delete(0, tk.END)
@@ -354,6 +553,22 @@ class InkPaint:
         if self.layers:
             self.layers_listbox.select_set(self.current_layer_index)
 
+    def _register_stroke(self, layer, stroke):
+        # call once a stroke is in layer.strokes with its final points
+        self._stroke_index.insert(stroke)
+        self._stroke_by_id[(layer, stroke.id)] = stroke
+
+    def _unregister_stroke(self, layer, stroke):
+        self._stroke_index.remove(stroke)
+        key = (layer, stroke.id)
+        # a duplicate id in the same layer may own the entry; leave it alone then
+        if self._stroke_by_id.get(key) is stroke:
+            del self._stroke_by_id[key]
+
+    def _clear_stroke_lookups(self):
+        self._stroke_index.clear()
+        self._stroke_by_id.clear()
+
     def _current_layer(self):
         if not self.layers:
             return None
@@ -421,7 +636,7 @@ class InkPaint:
             sid = f"stroke_{self.stroke_counter}"
             self.stroke_counter += 1
             s = Stroke(sid, self.color, self.stroke_width)
-            s.points.append((wx, wy))
+            s.append_point(wx, wy)
             layer.strokes.append(s)
             self._active_stroke = s
             self._canvas_item_map.setdefault(s.id, [])
@@ -431,14 +646,15 @@ class InkPaint:
         elif self.tool == "eraser":
             sid = f"eraser_{int(time.time()*1000)}"
             s = Stroke(sid, None, self.eraser_width)
-            s.points.append((wx, wy))
+            s.append_point(wx, wy)
             self._active_eraser = s
             self._canvas_item_map.setdefault(s.id, [])
 
         # Shape tools
         elif self.tool in ("line", "rect", "ellipse"):
             self._shape_start = (wx, wy)
-            self._shape_preview = None
+            # create the preview item once; pointer moves only update its coords
+            self._create_shape_preview(e.x, e.y, e.x, e.y)
 
         # Select: start selection rectangle or start move if clicking inside existing selection
         elif self.tool == "select":
@@ -448,12 +664,12 @@ class InkPaint:
             if bbox and bbox[0] <= wx <= bbox[2] and bbox[1] <= wy <= bbox[3] and self.selected_strokes:
                 # start moving selection
                 self._moving_selection = True
-                # take snapshots for undo
-                snapshots = []
-                for s in self.selected_strokes:
-                    snapshots.append((s.id, s.copy_points(), None))  # new_points filled on release
-                self._move_snapshots = snapshots
+                # only the total translation is recorded for undo
+                self._move_start = (wx, wy)
                 self._move_last = (wx, wy)
+                # canvas items are keyed by stroke id, which is only unique per layer: a stroke
+                # sharing its id can't have its items shifted without dragging the other one's too
+                self._move_shared_ids = self._shared_stroke_ids({s.id for s in self.selected_strokes})
             else:
                 # start new select box
                 self._moving_selection = False
@@ -469,34 +685,27 @@ class InkPaint:
         # Brush drawing
         if self.tool == "brush" and getattr(self, "_active_stroke", None):
             s = self._active_stroke
-            last = s.points[-1]
-            s.points.append((wx, wy))
+            last = s.last_point()
+            s.append_point(wx, wy)
             self._canvas_draw_line_segment_world(last, (wx, wy), s.color, s.width, tag=s.id)
 
         # Eraser path
         elif self.tool == "eraser" and getattr(self, "_active_eraser", None):
             s = self._active_eraser
-            last = s.points[-1]
-            s.points.append((wx, wy))
+            last = s.last_point()
+            s.append_point(wx, wy)
             # draw eraser preview in screen coords (use bg color)
             self._canvas_draw_line_segment_world(last, (wx, wy), self.bg_color, s.width, tag=s.id)
 
         # Shape preview drawing (we draw preview on canvas in screen coords)
         elif self.tool in ("line", "rect", "ellipse") and getattr(self, "_shape_start", None):
-            if self._shape_preview:
-                try:
-                    self.canvas.delete(self._shape_preview)
-                except Exception:
-                    pass
             x0, y0 = self._shape_start
             sx0, sy0 = self.world_to_screen(x0, y0)
-            sx1, sy1 = self.world_to_screen(wx, wy)
-            if self.tool == "line":
-                self._shape_preview = self.canvas.create_line(sx0, sy0, sx1, sy1, fill=self.color, width=self.stroke_width)
-            elif self.tool == "rect":
-                self._shape_preview = self.canvas.create_rectangle(sx0, sy0, sx1, sy1, outline=self.color, width=self.stroke_width)
-            elif self.tool == "ellipse":
-                self._shape_preview = self.canvas.create_oval(sx0, sy0, sx1, sy1, outline=self.color, width=self.stroke_width)
+            if self._shape_preview and self.canvas.type(self._shape_preview):
+                self.canvas.coords(self._shape_preview, sx0, sy0, e.x, e.y)
+            else:
+                # a full redraw mid-drag (zoom, pan, resize) deleted it: make a new one
+                self._create_shape_preview(sx0, sy0, e.x, e.y)
 
         # Selection rectangle preview
         elif self.tool == "select" and getattr(self, "_sel_start", None) and not self._moving_selection:
@@ -517,12 +726,24 @@ class InkPaint:
             if dx == 0 and dy == 0:
                 return
             # move all selected strokes by dx,dy in world coords
+            sdx, sdy = dx * self.scale, dy * self.scale
+            redraw = []
             for s in self.selected_strokes:
-                s.points = [(px + dx, py + dy) for px, py in s.points]
-                # update canvas items
-                self._canvas_delete_strokes([s.id])
+                s.translate(dx, dy)
+                self._stroke_index.insert(s)
+                if s.id in self._move_shared_ids:
+                    redraw.append(s)
+                    continue
+                # shift the existing canvas items rather than recreating them
+                items = self._canvas_item_map.get(s.id)
+                if not items:
+                    redraw.append(s)  # culled by the last redraw; it may be coming into view
+                    continue
+                for it in items:
+                    self.canvas.move(it, sdx, sdy)
+            if redraw:
+                self._redraw_strokes(redraw)
             self._move_last = (wx, wy)
-            self._redraw_canvas()
 
     def on_pointer_up(self, e):
         wx, wy = self.screen_to_world(e.x, e.y)
@@ -534,18 +755,19 @@ class InkPaint:
         if self.tool == "brush" and getattr(self, "_active_stroke", None):
             s = self._active_stroke
             self._active_stroke = None
-            self.undo_stack.append(ActionAddStroke(self._current_layer().id, s))
-            self.redo_stack.clear()
-            self.status_set(f"Stroke added: {s.id} pts={len(s.points)}")
+            s.update_bbox()
+            self._register_stroke(self._current_layer(), s)
+            self._push_undo(ActionAddStroke(self._current_layer().id, s))
+            self.status_set(f"Stroke added: {s.id} pts={s.point_count()}")
 
         # Finish eraser: apply erase
         elif self.tool == "eraser" and getattr(self, "_active_eraser", None):
             eraser = self._active_eraser
             self._active_eraser = None
-            erased_ids = self._apply_eraser_path(eraser.points, eraser.width)
+            erased_ids = self._apply_eraser_path(list(eraser.iter_points()), eraser.width)
+            self._canvas_delete_strokes([eraser.id])  # drop the preview trail
             if erased_ids:
-                self.undo_stack.append(ActionEraseStrokes(self._current_layer().id, erased_ids))
-                self.redo_stack.clear()
+                self._push_undo(ActionEraseStrokes(self._current_layer().id, erased_ids))
                 self.status_set(f"Erased {len(erased_ids)} stroke(s)")
             else:
                 self.status_set("Eraser: nothing hit")
@@ -557,28 +779,26 @@ class InkPaint:
             self.stroke_counter += 1
             s = Stroke(s_id, self.color, self.stroke_width)
             if self.tool == "line":
-                s.points = [(x0, y0), (wx, wy)]
+                s.set_points([(x0, y0), (wx, wy)])
             else:
                 # approximate shape as polyline (ellipse) or rectangle polyline
                 if self.tool == "rect":
                     pts = [(x0,y0),(wx,y0),(wx,wy),(x0,wy),(x0,y0)]
-                    s.points = pts
+                    s.set_points(pts)
                 elif self.tool == "ellipse":
                     cx = (x0 + wx) / 2
                     cy = (y0 + wy) / 2
                     rx = abs(wx - x0) / 2
                     ry = abs(wy - y0) / 2
-                    steps = max(12, int(24 * max(rx, ry) / 100))
-                    pts = []
-                    for i in range(steps+1):
-                        t = 2*math.pi*i/steps
-                        px = cx + rx * math.cos(t)
-                        py = cy + ry * math.sin(t)
-                        pts.append((px,py))
-                    s.points = pts
+                    # sample density follows the on-screen radius, so ellipses drawn
+                    # while zoomed out are not over-sampled
+                    steps = max(12, int(24 * max(rx, ry) * self.scale / 100))
+                    step = math.tau / steps
+                    cos, sin = math.cos, math.sin
+                    s.set_points([(cx + rx * cos(i * step), cy + ry * sin(i * step)) for i in range(steps + 1)])
             self._current_layer().strokes.append(s)
-            self.undo_stack.append(ActionAddStroke(self._current_layer().id, s))
-            self.redo_stack.clear()
+            self._register_stroke(self._current_layer(), s)
+            self._push_undo(ActionAddStroke(self._current_layer().id, s))
             # cleanup
             if self._shape_preview:
                 try:
@@ -587,26 +807,21 @@ class InkPaint:
                     pass
             self._shape_start = None
             self._shape_preview = None
-            self._redraw_canvas()
+            self._redraw_strokes([s])
 
         # Finish select: either compute selection or finish moving
         elif self.tool == "select" and getattr(self, "_sel_start", None):
             if self._moving_selection:
-                # finish moving selection: record snapshots for undo
-                snapshots = []
-                for idx, (sid, old_pts, new_pts) in enumerate(self._move_snapshots):
-                    # find stroke current points
-                    s = self._find_stroke_by_id(sid)
-                    if s:
-                        new_points = s.copy_points()
-                        snapshots.append((sid, old_pts, new_points))
-                act = ActionMoveStrokes(self._current_layer().id, snapshots)
-                self.undo_stack.append(act)
-                self.redo_stack.clear()
+                # finish moving selection: record the total translation for undo
+                stroke_ids = [s.id for s in self.selected_strokes]
+                dx = self._move_last[0] - self._move_start[0]
+                dy = self._move_last[1] - self._move_start[1]
+                if dx or dy:
+                    self._push_move(self._current_layer().id, tuple(stroke_ids), dx, dy)
                 self._moving_selection = False
-                self._move_snapshots = None
+                self._move_start = None
                 self._move_last = None
-                self.status_set(f"Moved {len(snapshots)} stroke(s)")
+                self.status_set(f"Moved {len(stroke_ids)} stroke(s)")
             else:
                 # build selection list from rectangle
                 x0, y0 = self._sel_start
@@ -616,7 +831,7 @@ class InkPaint:
                 for s in self._current_layer().strokes:
                     if s.erased:
                         continue
-                    for px, py in s.points:
+                    for px, py in s.iter_points():
                         if xmin <= px <= xmax and ymin <= py <= ymax:
                             self.selected_strokes.append(s)
                             break
@@ -650,26 +865,65 @@ class InkPaint:
             self._canvas_item_map.setdefault(tag, []).append(item)
 
     def _canvas_draw_point_segment(self, stroke, idx):
-        if len(stroke.points) == 1:
-            xw, yw = stroke.points[0]
+        if stroke.point_count() == 1:
+            xw, yw = stroke.last_point()
             x, y = self.world_to_screen(xw, yw)
             r = max(1, stroke.width/2) * self.scale
             item = self.canvas.create_oval(x-r, y-r, x+r, y+r, fill=stroke.color, outline=stroke.color, tags=(stroke.id,))
             self._canvas_item_map.setdefault(stroke.id, []).append(item)
 
+    def _create_shape_preview(self, sx0, sy0, sx1, sy1):
+        if self.tool == "line":
+            self._shape_preview = self.canvas.create_line(sx0, sy0, sx1, sy1, fill=self.color, width=self.stroke_width)
+        elif self.tool == "rect":
+            self._shape_preview = self.canvas.create_rectangle(sx0, sy0, sx1, sy1, outline=self.color, width=self.stroke_width)
+        else:
+            self._shape_preview = self.canvas.create_oval(sx0, sy0, sx1, sy1, outline=self.color, width=self.stroke_width)
+
     def _canvas_delete_strokes(self, stroke_ids):
+        # gather every item of every stroke and delete them in one Tcl call
+        items = []
         for sid in stroke_ids:
-            items = self._canvas_item_map.pop(sid, [])
-            for it in items:
-                try:
-                    self.canvas.delete(it)
-                except Exception:
-                    pass
+            items.extend(self._canvas_item_map.pop(sid, ()))
+        if not items:
+            return
+        try:
+            self.canvas.delete(*items)
+        except Exception:
+            pass
+
+    def _invalidate(self):
+        # request a repaint; any number of calls within one event-loop turn cost a single redraw
+        if self._redraw_scheduled:
+            return
+        self._redraw_scheduled = True
+        self.root.after_idle(self._flush_redraw)
+
+    def _flush_redraw(self):
+        self._redraw_scheduled = False
+        self._redraw_canvas()
+
+    def _viewport_world(self):
+        # world-space rectangle currently shown by the canvas, or None before it is mapped
+        w = self.canvas.winfo_width()
+        h = self.canvas.winfo_height()
+        if w <= 1 or h <= 1:
+            return None
+        x0, y0 = self.screen_to_world(0, 0)
+        x1, y1 = self.screen_to_world(w, h)
+        return (x0, y0, x1, y1)
 
     def _redraw_canvas(self):
         # clears and redraws from model. layers are drawn from bottom (last) to top (first)
         self.canvas.delete("all")
         self._canvas_item_map.clear()
+        # only strokes the spatial index places in the viewport get canvas items, plus the
+        # brush stroke being drawn, which isn't indexed until pointer-up
+        view = self._viewport_world()
+        visible = self._stroke_index.query(*view) if view else None
+        active = self._active_stroke
+        if visible is not None and not visible and active is None:
+            return
         for layer in reversed(self.layers):  # bottom-first
             if not layer.visible:
                 continue
@@ -678,22 +932,59 @@ class InkPaint:
                     continue
                 if not stroke.points:
                     continue
-                if stroke.fill:
-                    # draw filled polygon if enough points
-                    if len(stroke.points) >= 3:
-                        flat = []
-                        for p in stroke.points:
-                            sx, sy = self.world_to_screen(*p)
-                            flat.extend([sx, sy])
-                        self.canvas.create_polygon(flat, fill=stroke.fill, outline=stroke.color if stroke.color else "", width=stroke.width, tags=(stroke.id,))
-                        self._canvas_item_map.setdefault(stroke.id, []).append(self.canvas.find_all()[-1])
-                if len(stroke.points) == 1:
-                    self._canvas_draw_point_segment(stroke, 0)
-                else:
-                    prev = stroke.points[0]
-                    for pt in stroke.points[1:]:
-                        self._canvas_draw_line_segment_world(prev, pt, stroke.color, stroke.width, tag=stroke.id)
-                        prev = pt
+                if visible is not None and stroke not in visible and stroke is not active:
+                    continue
+                self._canvas_draw_stroke(stroke)
+
+    def _redraw_strokes(self, strokes):
+        # repaint just these strokes (after an edit touched them) instead of rebuilding the
+        # scene; Tk re-exposes whatever lies underneath a deleted item by itself, so only the
+        # touched strokes' own items are recreated, then slotted back into their stacking place
+        # canvas items are tagged by stroke id, so a stroke sharing an id with a touched one
+        # (ids are only unique per layer) loses its items too and is repainted with it;
+        # touched strokes that were removed or erased are simply not drawn again
+        dirty = {s.id for s in strokes}
+        if not dirty:
+            return
+        self._canvas_delete_strokes(dirty)
+        above = None  # lowest canvas item of the nearest stroke painted above
+        for layer in self.layers:  # top-first, the reverse of paint order
+            if not layer.visible:
+                continue
+            for stroke in reversed(layer.strokes):
+                if stroke.id not in dirty:
+                    items = self._canvas_item_map.get(stroke.id)
+                    if items:
+                        above = items[0]
+                    continue
+                if stroke.erased or not stroke.points:
+                    continue
+                # only this stroke's new items: a same-id stroke may already own some in the map
+                start = len(self._canvas_item_map.get(stroke.id, ()))
+                self._canvas_draw_stroke(stroke)
+                items = self._canvas_item_map.get(stroke.id, [])[start:]
+                if not items:
+                    continue
+                if above is not None:
+                    for it in items:
+                        self.canvas.tag_lower(it, above)
+                above = items[0]
+
+    def _canvas_draw_stroke(self, stroke):
+        n = stroke.point_count()
+        if n == 1:
+            self._canvas_draw_point_segment(stroke, 0)
+            return
+        # screen coords built once in a single flat list, shared by the fill polygon and the outline
+        scale = self.scale
+        flat = [v * scale + o for v, o in zip(stroke.points, itertools.cycle((self.offset_x, self.offset_y)))]
+        items = self._canvas_item_map.setdefault(stroke.id, [])
+        if stroke.fill and n >= 3:
+            # draw filled polygon if enough points
+            items.append(self.canvas.create_polygon(flat, fill=stroke.fill, outline=stroke.color if stroke.color else "", width=stroke.width, tags=(stroke.id,)))
+        # one line item per stroke rather than one per segment
+        items.append(self.canvas.create_line(flat, fill=stroke.color, width=stroke.width,
+                                             capstyle=tk.ROUND, joinstyle=tk.ROUND, tags=(stroke.id,)))
 
     # ----------------------------
     # Eraser logic (simple hit test)
@@ -706,30 +997,50 @@ class InkPaint:
         if not layer:
             return []
         rad = eraser_width / 2.0
+        r2 = rad * rad
         erased_ids = []
+        erased = []
+        # only strokes indexed near the eraser path can be hit
+        exs = [p[0] for p in path_points_w]
+        eys = [p[1] for p in path_points_w]
+        candidates = self._stroke_index.query(min(exs) - rad, min(eys) - rad, max(exs) + rad, max(eys) + rad)
+        if not candidates:
+            return erased_ids
         for stroke in list(layer.strokes):
-            if stroke.erased:
+            if stroke.erased or stroke not in candidates:
                 continue
             # bbox quick check
-            xs = [p[0] for p in stroke.points]
-            ys = [p[1] for p in stroke.points]
-            if not xs or not ys:
+            if not stroke.bbox:
                 continue
-            # precise check: any point distance
+            bx0, by0, bx1, by1 = stroke.bbox
+            bx0 -= rad; by0 -= rad; bx1 += rad; by1 += rad
+            # keep only the eraser samples whose reach touches the stroke's box, in one
+            # comprehension rather than a branch per sample inside the point scan
+            near = [ep for ep in path_points_w if bx0 <= ep[0] <= bx1 and by0 <= ep[1] <= by1]
+            if not near:
+                continue
+            # precise check: any point distance. Points outside the sample's x-window are
+            # rejected with one chained comparison before any arithmetic is done
+            xs = stroke.points[0::2]
+            ys = stroke.points[1::2]
             hit = False
-            for ep in path_points_w:
-                for sp in stroke.points:
-                    dx = ep[0] - sp[0]
-                    dy = ep[1] - sp[1]
-                    if dx*dx + dy*dy <= rad*rad:
-                        hit = True
-                        break
+            for ex, ey in near:
+                lo, hi = ex - rad, ex + rad
+                for spx, spy in zip(xs, ys):
+                    if lo <= spx <= hi:
+                        dx = ex - spx
+                        dy = ey - spy
+                        if dx*dx + dy*dy <= r2:
+                            hit = True
+                            break
                 if hit:
                     break
             if hit:
                 stroke.erased = True
-                self._canvas_delete_strokes([stroke.id])
                 erased_ids.append(stroke.id)
+                erased.append(stroke)
+        # drops the erased strokes' items and repaints any other layer's stroke with the same id
+        self._redraw_strokes(erased)
         return erased_ids
 
     # ----------------------------
@@ -739,27 +1050,36 @@ class InkPaint:
     def _selection_bbox(self):
         if not self.selected_strokes:
             return None
-        xs = []
-        ys = []
-        for s in self.selected_strokes:
-            for x,y in s.points:
-                xs.append(x); ys.append(y)
-        return (min(xs), min(ys), max(xs), max(ys))
+        boxes = [s.bbox for s in self.selected_strokes if s.bbox]
+        if not boxes:
+            return None
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                max(b[2] for b in boxes), max(b[3] for b in boxes))
 
     # ----------------------------
     # Simple eyedropper: pick nearest stroke color under screen point
     # ----------------------------
     def _pick_color_under(self, sx, sy):
         wx, wy = self.screen_to_world(sx, sy)
-        # check current layer strokes first
+        candidates = self._stroke_index.query(wx, wy, wx, wy)
+        if not candidates:
+            return self.bg_color
+        # walk in paint order (top layer, newest stroke first) but only test nearby strokes
         for layer in self.layers:
             for s in reversed(layer.strokes):
-                if s.erased:
+                if s.erased or s not in candidates or not s.bbox:
+                    continue
+                r = max(1, (s.width or 1)/2)
+                bx0, by0, bx1, by1 = s.bbox
+                if not (bx0 - r <= wx <= bx1 + r and by0 - r <= wy <= by1 + r):
                     continue
-                for px, py in s.points:
-                    dx = px - wx; dy = py - wy
-                    if dx*dx + dy*dy <= max(1, (s.width or 1)/2)**2:
-                        return s.color
+                r2 = r * r
+                lo, hi = wx - r, wx + r
+                for px, py in s.iter_points():
+                    if lo <= px <= hi:
+                        dx = px - wx; dy = py - wy
+                        if dx*dx + dy*dy <= r2:
+                            return s.color
         # fallback background
         return self.bg_color
 
@@ -767,38 +1087,66 @@ class InkPaint:
     # Undo / Redo
     # ----------------------------
 
+    def _push_undo(self, act):
+        # record a new user action: bounded history, and any redo branch is dropped
+        self.undo_stack.append(act)
+        self.redo_stack.clear()
+        self._dirty = True
+
+    def _push_move(self, layer_id, stroke_ids, dx, dy):
+        # a drag that quickly follows another drag of the same selection extends that move
+        # instead of adding a history entry of its own
+        now = time.monotonic()
+        last = self._last_move
+        if (last is not None and self.undo_stack and self.undo_stack[-1] is last
+                and last.layer_id == layer_id and last.stroke_ids == stroke_ids
+                and now - self._last_move_time < MOVE_COALESCE_S):
+            last.dx += dx
+            last.dy += dy
+            self.redo_stack.clear()
+            self._dirty = True
+        else:
+            last = ActionMoveStrokes(layer_id, stroke_ids, dx, dy)
+            self._push_undo(last)
+        self._last_move = last
+        self._last_move_time = now
+
     def undo(self):
         if not self.undo_stack:
             self.status_set("Nothing to undo")
             return
         act = self.undo_stack.pop()
+        self._dirty = True
+        restored = []  # strokes whose canvas items must be rebuilt
         if isinstance(act, ActionAddStroke):
             layer = self._layer_by_id(act.layer_id)
-            if layer:
-                for s in list(layer.strokes):
-                    if s.id == act.stroke.id:
-                        layer.strokes.remove(s)
-                        self._canvas_delete_strokes([s.id])
-                        self.redo_stack.append(act)
-                        break
+            s = self._find_stroke_by_id(layer, act.stroke.id) if layer else None
+            if s:
+                layer.strokes.remove(s)
+                self._unregister_stroke(layer, s)
+                restored.append(s)
+                self.redo_stack.append(act)
         elif isinstance(act, ActionEraseStrokes):
             layer = self._layer_by_id(act.layer_id)
             if layer:
                 for sid in act.stroke_ids:
-                    for s in layer.strokes:
-                        if s.id == sid:
-                            s.erased = False
+                    s = self._find_stroke_by_id(layer, sid)
+                    if s:
+                        s.erased = False
+                        restored.append(s)
                 self.redo_stack.append(act)
         elif isinstance(act, ActionMoveStrokes):
             layer = self._layer_by_id(act.layer_id)
             if layer:
-                # restore old points
-                for sid, old_pts, new_pts in act.stroke_snapshots:
-                    s = self._find_stroke_by_id(sid)
+                # move back by the recorded translation
+                for sid in act.stroke_ids:
+                    s = self._find_stroke_by_id(layer, sid)
                     if s:
-                        s.points = [ (x,y) for (x,y) in old_pts ]
+                        s.translate(-act.dx, -act.dy)
+                        self._stroke_index.insert(s)
+                        restored.append(s)
                 self.redo_stack.append(act)
-        self._redraw_canvas()
+        self._redraw_strokes(restored)
         self.status_set("Undo")
 
     def redo(self):
@@ -806,31 +1154,36 @@ class InkPaint:
             self.status_set("Nothing to redo")
             return
         act = self.redo_stack.pop()
+        self._dirty = True
+        restored = []  # strokes whose canvas items must be rebuilt
         if isinstance(act, ActionAddStroke):
             layer = self._layer_by_id(act.layer_id)
             if layer:
                 layer.strokes.append(act.stroke)
-                self._redraw_canvas()
+                self._register_stroke(layer, act.stroke)
+                restored.append(act.stroke)
                 self.undo_stack.append(act)
         elif isinstance(act, ActionEraseStrokes):
             layer = self._layer_by_id(act.layer_id)
             if layer:
                 for sid in act.stroke_ids:
-                    for s in layer.strokes:
-                        if s.id == sid:
-                            s.erased = True
-                self._canvas_delete_strokes(act.stroke_ids)
+                    s = self._find_stroke_by_id(layer, sid)
+                    if s:
+                        s.erased = True
+                        restored.append(s)
                 self.undo_stack.append(act)
         elif isinstance(act, ActionMoveStrokes):
-            # apply new points
+            # apply the translation again
             layer = self._layer_by_id(act.layer_id)
             if layer:
-                for sid, old_pts, new_pts in act.stroke_snapshots:
-                    s = self._find_stroke_by_id(sid)
+                for sid in act.stroke_ids:
+                    s = self._find_stroke_by_id(layer, sid)
                     if s:
-                        s.points = [ (x,y) for (x,y) in new_pts ]
+                        s.translate(act.dx, act.dy)
+                        self._stroke_index.insert(s)
+                        restored.append(s)
                 self.undo_stack.append(act)
-        self._redraw_canvas()
+        self._redraw_strokes(restored)
         self.status_set("Redo")
 
     def _layer_by_id(self, lid):
@@ -839,12 +1192,25 @@ class InkPaint:
                 return l
         return None
 
-    def _find_stroke_by_id(self, sid):
-        for l in self.layers:
-            for s in l.strokes:
-                if s.id == sid:
-                    return s
-        return None
+    def _shared_stroke_ids(self, ids):
+        # those of `ids` that more than one stroke (in any layer) goes by
+        seen, shared = set(), set()
+        for layer in self.layers:
+            for st in layer.strokes:
+                if st.id in ids:
+                    if st.id in seen:
+                        shared.add(st.id)
+                    seen.add(st.id)
+        return shared
+
+    def _find_stroke_by_id(self, layer, sid):
+        s = self._stroke_by_id.get((layer, sid))
+        if s is None:
+            # not indexed (e.g. a duplicate id within the layer): fall back to a scan
+            for st in layer.strokes:
+                if st.id == sid:
+                    return st
+        return s
 
     # ----------------------------
     # Save / Load .inks (includes fill)
@@ -855,78 +1221,94 @@ class InkPaint:
         if not path:
             return
         try:
+            text = self._serialize_inks()
             with open(path, "w", encoding="utf-8") as f:
-                f.write("inkscript 1.0\n\n")
-                f.write(f"canvas {self.width} {self.height}\n")
-                f.write(f"background {self.bg_color}\n\n")
-                # write layers in order (top first)
-                for layer in self.layers:
-                    f.write(f'layer id={layer.id} name="{layer.name}" visible={"true" if layer.visible else "false"} {{\n')
-                    for s in layer.strokes:
-                        if not s.erased:
-                            f.write(f"  draw path id={s.id} {{\n")
-                            first = True
-                            for x, y in s.points:
-                                cmd = "move" if first else "line"
-                                f.write(f"    {cmd} {float(x):.2f} {float(y):.2f}\n")
-                                first = False
-                            # close block and write inline style tokens on same line for easier parsing
-                            pieces = ["  }"]
-                            if s.color:
-                                pieces.append(f"stroke={s.color}")
-                            if s.fill:
-                                pieces.append(f"fill={s.fill}")
-                            pieces.append(f"strokeWidth={int(s.width)}")
-                            f.write(" ".join(pieces) + "\n\n")
-                        else:
-                            f.write(f"  erase ref={s.id}\n")
-                    f.write("}\n\n")
+                f.write(text)
+            self._dirty = False
             self.status_set(f"Saved {os.path.basename(path)}")
         except Exception as e:
             messagebox.showerror("Save error", str(e))
             self.status_set("Save failed")
 
+    def _serialize_inks(self):
+        # the whole document as .inks text; pieces are collected and joined once
+        # so saving costs a single write instead of one per point
+        out = ["inkscript 1.0\n\n",
+               f"canvas {self.width} {self.height}\n",
+               f"background {self.bg_color}\n\n"]
+        append = out.append
+        extend = out.extend
+        # write layers in order (top first)
+        for layer in self.layers:
+            append(f'layer id={layer.id} name="{layer.name}" visible={"true" if layer.visible else "false"} {{\n')
+            for s in layer.strokes:
+                if not s.erased:
+                    append(f"  draw path id={s.id} {{\n")
+                    pts = s.points
+                    if pts:
+                        # one "move" for the first point, then every remaining pair as "line"
+                        append(f"    move {pts[0]:.2f} {pts[1]:.2f}\n")
+                        rest = itertools.islice(pts, 2, None)
+                        extend(["    line %.2f %.2f\n" % xy for xy in zip(rest, rest)])
+                    # close block and write inline style tokens on same line for easier parsing
+                    pieces = ["  }"]
+                    if s.color:
+                        pieces.append(f"stroke={s.color}")
+                    if s.fill:
+                        pieces.append(f"fill={s.fill}")
+                    pieces.append(f"strokeWidth={int(s.width)}")
+                    append(" ".join(pieces) + "\n\n")
+                else:
+                    append(f"  erase ref={s.id}\n")
+            append("}\n\n")
+        return "".join(out)
+
     def open_inks(self):
         path = filedialog.askopenfilename(filetypes=[("InkScript", "*.inks"), ("All files", "*.*")])
         if not path:
             return
         try:
             with open(path, "r", encoding="utf-8") as f:
-                lines = f.readlines()
-            self._load_from_lines(lines)
+                text = f.read()
+            self._load_from_text(text)
             self.status_set(f"Opened {os.path.basename(path)}")
         except Exception as e:
             messagebox.showerror("Open error", str(e))
             self.status_set("Open failed")
 
-    def _load_from_lines(self, lines):
+    def _load_from_text(self, text):
         """
         Robust parser for .inks files. Handles style tokens placed after the closing brace on the same line.
+        Statements are located with one line-anchored regex scan over the whole text, and each
+        draw block is consumed in one step: its points come from a single findall over the body.
         """
         self.layers.clear()
+        self._clear_stroke_lookups()
         self.layer_counter = 1
         self.stroke_counter = 1
         current_layer = None
-        in_draw = False
-        draw_id = None
-        draw_pts = []
-
-        def parse_attrs_from_header(text):
-            # returns dict of attributes like id, name, visible
-            attrs = dict(re.findall(r'(\w+)=("[^"]+"|\S+)', text))
-            return attrs
-
-        def parse_style_tokens(style_text):
-            style = {}
-            if not style_text:
-                return style
-            for token in style_text.strip().split():
-                if "=" in token:
-                    k, v = token.split("=", 1)
-                    style[k] = v.strip().strip('"')
-            return style
-
-        def finish_draw_block(layer_ref, sid, pts, style_tokens):
+
+        def parse_tokens(text):
+            # one scan over the text for every id/ref/style token, quotes stripped
+            return {k: v.strip('"') for k, v in _TOKEN_RE.findall(text)}
+
+        def parse_points(body):
+            pairs = _POINT_RE.findall(body)
+            try:
+                return array.array("f", map(float, itertools.chain.from_iterable(pairs)))
+            except ValueError:
+                # a malformed coordinate only drops its own point
+                flat = array.array("f")
+                for xs, ys in pairs:
+                    try:
+                        x = float(xs); y = float(ys)
+                    except ValueError:
+                        continue
+                    flat.append(x)
+                    flat.append(y)
+                return flat
+
+        def finish_draw_block(layer_ref, sid, flat, style_tokens):
             if not layer_ref:
                 return
             if not sid:
@@ -934,8 +1316,10 @@ class InkPaint:
             color = style_tokens.get("stroke") or style_tokens.get("color") or "#000000"
             fill = style_tokens.get("fill")
             width = int(float(style_tokens.get("strokeWidth", style_tokens.get("width", "2"))))
-            st = Stroke(sid, color, width, pts, fill=fill)
+            st = Stroke(sid, color, width, fill=fill)
+            st.set_flat_points(flat)
             layer_ref.strokes.append(st)
+            self._register_stroke(layer_ref, st)
             # update counters
             if sid.startswith("stroke_"):
                 try:
@@ -945,70 +1329,29 @@ class InkPaint:
                 except Exception:
                     pass
 
-        idx = 0
-        n = len(lines)
-        while idx < n:
-            raw = lines[idx]
-            idx += 1
-            line = raw.rstrip("\n")
-            stripped = line.strip()
-            if not stripped or stripped.startswith("#"):
-                continue
+        pos = 0
+        while True:
+            m = _STMT_RE.search(text, pos)
+            if not m:
+                break
+            pos = m.end()
+            kw = m.group(1)
+            stripped = m.group(0).strip()
 
-            # if we're currently inside a draw block, collect commands until we find a line with '}'
-            if in_draw:
-                if '}' in line:
-                    left, _, right = line.partition('}')
-                    # process left part as possible move/line commands
-                    for ln in left.splitlines():
-                        s2 = ln.strip()
-                        if not s2:
-                            continue
-                        parts = s2.split()
-                        if parts[0] in ("move", "line") and len(parts) >= 3:
-                            try:
-                                x = float(parts[1]); y = float(parts[2])
-                                draw_pts.append((x, y))
-                            except Exception:
-                                pass
-                    # parse style tokens on the remainder of the line (right) and possibly following tokens
-                    style_part = right.strip()
-                    # If style_part is empty, maybe next non-empty line contains style tokens — but our writer writes them on same line
-                    style = parse_style_tokens(style_part)
-                    finish_draw_block(current_layer, draw_id, draw_pts, style)
-                    in_draw = False
-                    draw_id = None
-                    draw_pts = []
-                else:
-                    # regular command line inside draw
-                    for ln in line.splitlines():
-                        s2 = ln.strip()
-                        if not s2:
-                            continue
-                        parts = s2.split()
-                        if parts[0] in ("move", "line") and len(parts) >= 3:
-                            try:
-                                x = float(parts[1]); y = float(parts[2])
-                                draw_pts.append((x, y))
-                            except Exception:
-                                pass
-                continue
-
-            # not in draw state
-            if stripped.startswith("canvas"):
+            if kw == "canvas":
                 parts = stripped.split()
                 if len(parts) >= 3:
                     try:
                         self.width = int(parts[1]); self.height = int(parts[2])
                     except Exception:
                         pass
-            elif stripped.startswith("background"):
+            elif kw == "background":
                 parts = stripped.split(None, 1)
                 if len(parts) == 2:
                     self.bg_color = parts[1].strip()
-            elif stripped.startswith("layer"):
+            elif kw == "layer":
                 # handle layer header; may or may not have '{' at end
-                attrs = parse_attrs_from_header(stripped)
+                attrs = dict(_ATTR_RE.findall(stripped))
                 try:
                     lid = int(attrs.get("id", self.layer_counter))
                 except Exception:
@@ -1020,76 +1363,46 @@ class InkPaint:
                     self.layer_counter = lid + 1
                 self.layers.append(current_layer)
                 # if header doesn't actually contain '{', we assume next lines will contain strokes until a lone '}'
-            elif stripped.startswith("}"):
+            elif kw == "}":
                 # close current layer block (if any)
                 current_layer = None
-            elif stripped.startswith("draw") and "path" in stripped and current_layer:
-                # prepare a draw block; check for immediate inline close
-                m = re.search(r'id=("[^"]+"|\S+)', stripped)
-                sid = None
-                if m:
-                    sid = m.group(1).strip('"')
-                # If the line has both '{' and '}' on same line, handle quickly
-                if '{' in line and '}' in line and line.index('}') > line.index('{'):
-                    inner = line.split('{',1)[1].split('}',1)[0]
-                    # parse inner commands
-                    for ln in inner.splitlines():
-                        s2 = ln.strip()
-                        if not s2:
-                            continue
-                        parts = s2.split()
-                        if parts[0] in ("move", "line") and len(parts) >= 3:
-                            try:
-                                x = float(parts[1]); y = float(parts[2])
-                                draw_pts.append((x, y))
-                            except Exception:
-                                pass
-                    # parse style after the '}'
-                    after = line.split('}',1)[1]
-                    style = parse_style_tokens(after)
-                    finish_draw_block(current_layer, sid, draw_pts, style)
-                    draw_pts = []
-                    draw_id = None
-                    in_draw = False
-                else:
-                    # enter draw state and continue reading following lines
-                    in_draw = True
-                    draw_id = sid
-                    draw_pts = []
-                    # if there is content after '{' on same line, capture it as first commands
-                    if '{' in line:
-                        content_after_brace = line.split('{',1)[1]
-                        # but if there's a '}' later we would've handled above; so treat these as initial lines
-                        for ln in content_after_brace.splitlines():
-                            s2 = ln.strip()
-                            if not s2:
-                                continue
-                            parts = s2.split()
-                            if parts[0] in ("move", "line") and len(parts) >= 3:
-                                try:
-                                    x = float(parts[1]); y = float(parts[2])
-                                    draw_pts.append((x, y))
-                                except Exception:
-                                    pass
-            elif stripped.startswith("erase") and current_layer:
-                m = re.search(r'ref=("[^"]+"|\S+)', stripped)
-                if m:
-                    rid = m.group(1).strip('"')
-                    # find stroke in current layer and mark erased
-                    for s in current_layer.strokes:
-                        if s.id == rid:
-                            s.erased = True
-                            break
-            else:
-                # unrecognized line — ignore safely
-                continue
-
-        # final cleanup: if a draw block never closed, still attempt to finish it
-        if in_draw and draw_pts:
-            finish_draw_block(current_layer, draw_id, draw_pts, {})
+            elif kw == "draw":
+                if "path" not in stripped or not current_layer:
+                    continue
+                sid = parse_tokens(stripped).get("id")
+                # the body starts after '{' (possibly on this same line) and runs to the first '}'
+                # outside a comment line; style tokens follow that '}' on its line
+                brace = text.find("{", m.start(), m.end())
+                body_start = brace + 1 if brace >= 0 else m.end()
+                close = text.find("}", body_start)
+                while close >= 0:
+                    bol = text.rfind("\n", 0, close) + 1
+                    if bol <= body_start or not text[bol:close].lstrip().startswith("#"):
+                        break
+                    close = text.find("}", text.find("\n", close) + 1 or len(text))
+                if close < 0:
+                    # a draw block that never closed still keeps whatever points it had
+                    flat = parse_points(text[body_start:])
+                    if flat:
+                        finish_draw_block(current_layer, sid, flat, {})
+                    break
+                eol = text.find("\n", close)
+                if eol < 0:
+                    eol = len(text)
+                finish_draw_block(current_layer, sid, parse_points(text[body_start:close]),
+                                  parse_tokens(text[close + 1:eol]))
+                pos = eol
+            elif kw == "erase" and current_layer:
+                rid = parse_tokens(stripped).get("ref")
+                if rid:
+                    # mark the stroke erased if it belongs to the current layer
+                    s = self._find_stroke_by_id(current_layer, rid)
+                    if s:
+                        s.erased = True
 
+        self._dirty = False
         self._refresh_layer_list()
-        self._redraw_canvas()
+        self._invalidate()
         self.status_set("Loaded .inks")
 
     # ----------------------------
@@ -1103,25 +1416,30 @@ class InkPaint:
         try:
             img = Image.new("RGBA", (self.width, self.height), self._hex_to_rgb_alpha(self.bg_color))
             draw = ImageDraw.Draw(img)
+            line, polygon, ellipse = draw.line, draw.polygon, draw.ellipse
+            # strokes are painted in document order (overlaps must stay correct), so the
+            # per-stroke work is kept to the PIL call itself; colors come pre-resolved on the stroke
             for layer in reversed(self.layers):
                 if not layer.visible:
                     continue
                 for stroke in layer.strokes:
                     if stroke.erased:
                         continue
+                    # the flat float32 point buffer is passed to PIL as-is
                     pts = stroke.points
                     if not pts:
                         continue
-                    col = self._hex_to_rgb(stroke.color or "#000000")
-                    if stroke.fill and len(pts) >= 3:
-                        draw.polygon(pts, fill=self._hex_to_rgb(stroke.fill))
-                    if len(pts) == 1:
-                        x,y = pts[0]
+                    n = len(pts) >> 1
+                    col = stroke.rgb
+                    if stroke.fill_rgb and n >= 3:
+                        polygon(pts, fill=stroke.fill_rgb)
+                    if n == 1:
+                        x, y = pts
                         r = max(1, stroke.width/2)
-                        draw.ellipse([x-r,y-r,x+r,y+r], fill=col, outline=col)
+                        ellipse([x-r,y-r,x+r,y+r], fill=col, outline=col)
                     else:
-                        flat = [coord for p in pts for coord in p]
-                        draw.line(flat, fill=col, width=int(stroke.width))
+                        # the whole polyline goes to PIL in one call
+                        line(pts, fill=col, width=int(stroke.width))
             img.save(path)
             self.status_set(f"Exported PNG: {os.path.basename(path)}")
         except Exception as e:
@@ -1132,14 +1450,7 @@ class InkPaint:
     # Helpers: colors, coords
     # ----------------------------
     def _hex_to_rgb(self, h):
-        if not h:
-            return (0,0,0)
-        h = h.lstrip("#")
-        if len(h) == 6:
-            return tuple(int(h[i:i+2], 16) for i in (0, 2, 4))
-        if len(h) == 3:
-            return tuple(int(h[i]*2, 16) for i in range(3))
-        return (0,0,0)
+        return _hex_to_rgb(h)
 
     def _hex_to_rgb_alpha(self, h):
         rgb = self._hex_to_rgb(h)
@@ -1177,7 +1488,7 @@ class InkPaint:
         # adjust offsets so mouse focus remains stable
         self.offset_x = sx - wx_before * self.scale
         self.offset_y = sy - wy_before * self.scale
-        self._redraw_canvas()
+        self._invalidate()
 
     def _on_right_down(self, event):
         # start panning
@@ -1191,7 +1502,7 @@ class InkPaint:
         self.offset_x += dx
         self.offset_y += dy
         self._pan_last = (event.x, event.y)
-        self._redraw_canvas()
+        self._invalidate()
 
     def _on_right_up(self, event):
         self._pan_last = None
@@ -1205,28 +1516,30 @@ class InkPaint:
             return
         # find first stroke whose polygon contains point (ray-casting)
         for s in reversed(layer.strokes):
-            if s.erased or not s.points or len(s.points) < 3:
+            if s.erased or s.point_count() < 3:
                 continue
-            if self._point_in_polygon((wx,wy), s.points):
+            if self._point_in_polygon((wx,wy), s.points, s.bbox):
                 s.fill = self.color
-                self.undo_stack.append(ActionAddStroke(layer.id, s))  # treat as change to allow undo (coarse)
-                self.redo_stack.clear()
-                self._redraw_canvas()
+                self._push_undo(ActionAddStroke(layer.id, s))  # treat as change to allow undo (coarse)
+                self._redraw_strokes([s])
                 self.status_set("Fill applied")
                 return
         self.status_set("No closed shape found to fill")
 
-    def _point_in_polygon(self, point, polygon):
-        # ray-casting algorithm
+    def _point_in_polygon(self, point, polygon, bbox=None):
+        # ray-casting algorithm; polygon is a flat x0, y0, x1, y1, ... sequence
         x, y = point
+        # a point outside the cached bounding box can't be inside the polygon
+        if bbox and not (bbox[0] <= x <= bbox[2] and bbox[1] <= y <= bbox[3]):
+            return False
         inside = False
-        n = len(polygon)
-        for i in range(n):
-            xi, yi = polygon[i]
-            xj, yj = polygon[(i+1)%n]
-            intersect = ((yi > y) != (yj > y)) and (x < (xj - xi) * (y - yi) / (yj - yi + 1e-12) + xi)
-            if intersect:
+        # walk edges (i, i+1) by carrying the previous vertex instead of indexing with modulo
+        xi, yi = polygon[-2], polygon[-1]
+        it = iter(polygon)
+        for xj, yj in zip(it, it):
+            if ((yi > y) != (yj > y)) and (x < (xj - xi) * (y - yi) / (yj - yi + 1e-12) + xi):
                 inside = not inside
+            xi, yi = xj, yj
         return inside
 
     # ----------------------------
@@ -1240,45 +1553,54 @@ class InkPaint:
 
     def _do_autosave(self):
         try:
-            # write to temp path
+            if not self._dirty:
+                return  # nothing changed since the last save/autosave
+            # serialize on the Tk thread (strokes can change under a running edit),
+            # then leave the disk write to a background thread so the UI never waits on it
             try:
-                with open(AUTOSAVE_FILENAME, "w", encoding="utf-8") as f:
-                    f.write("inkscript 1.0\n\n")
-                    f.write(f"canvas {self.width} {self.height}\n")
-                    f.write(f"background {self.bg_color}\n\n")
-                    for layer in self.layers:
-                        f.write(f'layer id={layer.id} name="{layer.name}" visible={"true" if layer.visible else "false"} {{\n')
-                        for s in layer.strokes:
-                            if not s.erased:
-                                f.write(f"  draw path id={s.id} {{\n")
-                                first = True
-                                for x, y in s.points:
-                                    cmd = "move" if first else "line"
-                                    f.write(f"    {cmd} {float(x):.2f} {float(y):.2f}\n")
-                                    first = False
-                                pieces = ["  }"]
-                                if s.color:
-                                    pieces.append(f"stroke={s.color}")
-                                if s.fill:
-                                    pieces.append(f"fill={s.fill}")
-                                pieces.append(f"strokeWidth={int(s.width)}")
-                                f.write(" ".join(pieces) + "\n\n")
-                            else:
-                                f.write(f"  erase ref={s.id}\n")
-                        f.write("}\n\n")
+                text = self._serialize_inks()
+                # cleared up front so edits made during the write mark it dirty again;
+                # _autosave_done puts it back if the write fails
+                self._dirty = False
+                threading.Thread(target=self._write_autosave, args=(text,), daemon=True).start()
             except Exception:
-                pass
-            self.status_set("Autosaved")
+                self._dirty = True
         finally:
             self._schedule_autosave()
 
+    def _write_autosave(self, text):
+        # runs on a worker thread: write to a temp path, then swap it in atomically so a
+        # crash mid-write never leaves a truncated autosave behind
+        tmp = AUTOSAVE_FILENAME + ".tmp"
+        ok = False
+        with self._autosave_lock:
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(text)
+                os.replace(tmp, AUTOSAVE_FILENAME)
+                ok = True
+            except Exception:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+        # hand the result back to the Tk thread; widgets and _dirty are only touched there
+        self.root.after(0, self._autosave_done, ok)
+
+    def _autosave_done(self, ok):
+        if ok:
+            self.status_set("Autosaved")
+        else:
+            self._dirty = True  # nothing reached disk; try again on the next tick
+            self.status_set("Autosave failed")
+
     def _prompt_recover_autosave(self):
         ans = messagebox.askyesno("Recover", "An autosave file was found. Recover it?")
         if ans:
             try:
                 with open(AUTOSAVE_FILENAME, "r", encoding="utf-8") as f:
-                    lines = f.readlines()
-                self._load_from_lines(lines)
+                    text = f.read()
+                self._load_from_text(text)
                 self.status_set("Recovered from autosave")
             except Exception:
                 messagebox.showerror("Recover failed", "Failed to recover autosave file.")